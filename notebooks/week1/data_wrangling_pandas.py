@@ -47,6 +47,8 @@
 
 # 🛠 Section 3 – Load Libraries
 
+import os
+
 import pandas as pd
 import matplotlib.pyplot as plt
 
@@ -65,6 +67,8 @@ import matplotlib.pyplot as plt
 # MAGIC - `order_details.csv` (individual ordered items)
 # MAGIC
 # MAGIC 💡 Teaching Note: Reinforce the path structure. Students often forget the leading `/Volumes/` prefix.
+# MAGIC
+# MAGIC 💡 Teaching Note: Passing `dtype=` tells pandas the column types up front, so it does not have to guess. Dates and times are read as text and converted in Section 6, where we can count values that fail to parse. The `pyarrow` engine reads the file in fast native code and stores columns in Arrow format.
 # MAGIC """
 
 # COMMAND ----------
@@ -73,9 +77,32 @@ import matplotlib.pyplot as plt
 menu_path = "/Volumes/workspace/default/pandas/menu_items.csv"
 order_path = "/Volumes/workspace/default/pandas/order_details.csv"
 
-# Read the CSVs
-menu_df = pd.read_csv(menu_path)
-order_df = pd.read_csv(order_path)
+# COMMAND ----------
+
+# Read the CSVs with the PyArrow engine and explicit dtypes
+# (no type guessing, no dtype warnings, and Arrow-backed columns use less memory)
+menu_df = pd.read_csv(
+    menu_path,
+    engine="pyarrow",
+    dtype_backend="pyarrow",
+    dtype={"menu_item_id": "int32[pyarrow]", "item_name": "string[pyarrow]", "category": "string[pyarrow]", "price": "float32[pyarrow]"},
+)
+order_df = pd.read_csv(
+    order_path,
+    engine="pyarrow",
+    dtype_backend="pyarrow",
+    dtype={"order_id": "int32[pyarrow]", "item_id": "int32[pyarrow]", "order_date": "string[pyarrow]", "order_time": "string[pyarrow]"},
+)
+
+# Downcast numbers to the smallest type that fits (fewer bytes to scan in every merge/groupby)
+menu_df["menu_item_id"] = pd.to_numeric(menu_df["menu_item_id"], downcast="integer")
+menu_df["price"] = pd.to_numeric(menu_df["price"], downcast="float")
+order_df["item_id"] = pd.to_numeric(order_df["item_id"], downcast="integer")
+
+# Give both join keys the same dtype (the wider one) so the merge does not have to upcast
+key_dtype = max(order_df["item_id"].dtype, menu_df["menu_item_id"].dtype, key=lambda d: d.itemsize)
+order_df["item_id"] = order_df["item_id"].astype(key_dtype)
+menu_df["menu_item_id"] = menu_df["menu_item_id"].astype(key_dtype)
 
 print("Loaded menu_df with shape:", menu_df.shape)
 print("Loaded order_df with shape:", order_df.shape)
@@ -157,14 +184,27 @@ print("\nMissing values in order_df:\n", order_missing)
 
 # COMMAND ----------
 
-# Example: fill missing category with 'Unknown'
-menu_df["category"] = menu_df["category"].fillna("Unknown")
+# Clean the menu in one pipeline (one new DataFrame instead of several copies):
+# - fill missing category with 'Unknown'
+# - fix inconsistent categories (trim/standardize case)
+# - drop rows where price is missing (if critical)
+# - remove duplicate menu items by id
+cat = menu_df["category"].fillna("Unknown").str.strip().str.title()
+mask = menu_df["price"].notna()
+
+before_clean = len(menu_df)
+menu_df = (
+    menu_df.assign(category=cat)
+    .loc[mask]
+    .drop_duplicates(subset=["menu_item_id"], ignore_index=True)
+)
+print(f"Removed {before_clean - len(menu_df)} menu rows (missing price or duplicate id)")
 
-# Example: drop rows where price is missing (if critical)
-menu_df = menu_df.dropna(subset=["price"])
+# Check once here that each menu item id appears only one time (needed for a many-to-one merge)
+assert menu_df["menu_item_id"].is_unique
 
-# Example: inconsistent categories (trim/standardize case)
-menu_df["category"] = menu_df["category"].str.strip().str.title()
+# Store repeated text labels as 'category' dtype (small integer codes = faster groupby, less memory)
+menu_df["category"] = menu_df["category"].astype("category")
 
 # COMMAND ----------
 
@@ -174,23 +214,22 @@ menu_df["category"] = menu_df["category"].str.strip().str.title()
 
 # COMMAND ----------
 
-# Remove duplicate menu items by id
-before_dupes = len(menu_df)
-menu_df = menu_df.drop_duplicates(subset=["menu_item_id"])
-after_dupes = len(menu_df)
-print(f"Removed {before_dupes - after_dupes} duplicate menu rows")
+# Convert date and time columns
+# Parse each once with an explicit format (fast path); errors="coerce" turns bad values into NaT
+order_df["order_date"] = pd.to_datetime(order_df["order_date"], format="%m/%d/%y", errors="coerce")
 
-# COMMAND ----------
+# For time we keep only the hour we need
+order_time_parsed = pd.to_datetime(order_df["order_time"], format="%H:%M:%S", errors="coerce")
+order_df["order_hour"] = order_time_parsed.dt.hour.astype("Int8")
 
-# Convert date and time columns
-order_df["order_date"] = pd.to_datetime(order_df["order_date"], errors="coerce")
-order_df["order_time"] = pd.to_datetime(order_df["order_time"], errors="coerce").dt.time
+# Count rows where conversion failed (sum the True/False mask; no need to copy the rows)
+n_bad_dates = int(order_df["order_date"].isna().sum())
+n_bad_times = int(order_time_parsed.isna().sum())
+print("Rows with unparseable dates:", n_bad_dates)
+print("Rows with unparseable times:", n_bad_times)
 
-# Show rows where conversion failed
-bad_dates = order_df[order_df["order_date"].isna()]
-bad_times = order_df[pd.isna(order_df["order_time"])]
-print("Rows with unparseable dates:", len(bad_dates))
-print("Rows with unparseable times:", len(bad_times))
+# To look at the actual rows, filter only when needed:
+# order_df.loc[order_df["order_date"].isna()].head()
 
 # COMMAND ----------
 
@@ -205,8 +244,7 @@ print("Rows with unparseable times:", len(bad_times))
 # order_df["order_date"].dt.day_name()
 
 # GOOD example
-order_df["order_day"] = order_df["order_date"].dt.day_name()
-order_df["order_hour"] = pd.to_datetime(order_df["order_time"], format="%H:%M:%S", errors="coerce").dt.hour
+order_df["order_day"] = order_df["order_date"].dt.day_name().astype("category")
 order_df[["order_date", "order_day", "order_hour"]].head()
 
 # COMMAND ----------
@@ -226,11 +264,43 @@ order_df[["order_date", "order_day", "order_hour"]].head()
 # COMMAND ----------
 
 # Correct merge
-merged_df = order_df.merge(menu_df, how="left", left_on="item_id", right_on="menu_item_id", validate="many_to_one")
+# menu_item_id uniqueness was already checked during cleaning, so we skip `validate=` here
+merged_df = order_df.merge(menu_df, how="left", left_on="item_id", right_on="menu_item_id")
+merged_df["item_name"] = merged_df["item_name"].astype("category")
 merged_df.head()
 
 # COMMAND ----------
 
+# MAGIC %md
+# MAGIC """
+# MAGIC ⚡ Optional re-run shortcut (off by default, not part of the lesson): set `USE_CACHE = True` to save the cleaned + merged table to a Parquet file. In a later session, run Section 3, the file-path cell in Section 4, and then this cell: it loads `merged_df` and `order_df` from the file, so you can jump straight to Section 8 without parsing the CSVs again. If either CSV changed after the file was saved, the cell tells you to run Sections 4-7 again instead.
+# MAGIC """
+
+# COMMAND ----------
+
+USE_CACHE = False
+
+if USE_CACHE:
+    # One file per user, so people sharing a cluster do not read each other's cache
+    user = spark.sql("SELECT current_user()").first()[0]
+    cache_path = f"/tmp/week1_merged_{user.split('@')[0]}.parquet"
+    csv_mtime = max(os.path.getmtime(menu_path), os.path.getmtime(order_path))
+
+    if "merged_df" in globals():
+        merged_df.to_parquet(cache_path, engine="pyarrow", compression="zstd")
+        print("Saved cleaned + merged data to", cache_path)
+    elif os.path.exists(cache_path) and os.path.getmtime(cache_path) > csv_mtime:
+        # Read without dtype_backend so pandas restores the original dtypes (category, Int8)
+        merged_df = pd.read_parquet(cache_path).astype(
+            {"category": "category", "item_name": "category", "order_day": "category", "order_hour": "Int8"}
+        )
+        order_df = merged_df.drop(columns=["menu_item_id", "item_name", "category", "price"])
+        print("Loaded cleaned + merged data from cache:", merged_df.shape)
+    else:
+        print("No up-to-date cache file; run Sections 4-7 first")
+
+# COMMAND ----------
+
 # Bad merge example: wrong key (shows problem)
 try:
     bad_merge = order_df.merge(menu_df, left_on="order_id", right_on="menu_item_id", how="left", validate="many_to_one")
@@ -240,7 +310,7 @@ except Exception as e:
 # COMMAND ----------
 
 """
-💡 Teaching Note: Introduce `validate` to catch logic errors. If students see `ValidationError`, they know their keys are wrong.
+💡 Teaching Note: Introduce `validate` to catch logic errors. If students see `ValidationError`, they know their keys are wrong. In the correct merge we checked uniqueness once during cleaning instead, so pandas does not re-check the keys on every merge.
 """
 
 # COMMAND ----------
@@ -250,25 +320,32 @@ except Exception as e:
 # MAGIC # 🤝 Section 8 – GroupBy and Aggregation Examples
 # MAGIC
 # MAGIC Goal: Summarize orders by category, by hour, and by item.
+# MAGIC
+# MAGIC 💡 Teaching Note: Time features (`order_hour`, `order_day`) were created on `order_df`, so time summaries can use the smaller `order_df`. Only category and item summaries need the menu columns in `merged_df`.
 # MAGIC """
 
 # COMMAND ----------
 
 # Orders per category
-orders_by_category = merged_df.groupby("category").size().reset_index(name="order_count")
+orders_by_category = merged_df.groupby("category", observed=True).size().reset_index(name="order_count")
 orders_by_category
 
 # COMMAND ----------
 
-# Revenue per item
-merged_df["revenue"] = merged_df["price"]
-revenue_by_item = merged_df.groupby("item_name")["revenue"].sum().reset_index().sort_values(by="revenue", ascending=False)
+# Revenue per item (each order row is one item sold, so revenue = sum of price)
+revenue_by_item = (
+    merged_df.groupby("item_name", observed=True)["price"]
+    .sum()
+    .rename("revenue")
+    .reset_index()
+    .sort_values(by="revenue", ascending=False)
+)
 revenue_by_item.head()
 
 # COMMAND ----------
 
 # Orders per hour
-orders_by_hour = merged_df.groupby("order_hour").size().reset_index(name="order_count").sort_values("order_hour")
+orders_by_hour = order_df.groupby("order_hour", observed=True).size().reset_index(name="order_count").sort_values("order_hour")
 orders_by_hour.head()
 
 # COMMAND ----------
@@ -276,6 +353,8 @@ orders_by_hour.head()
 # MAGIC %md
 # MAGIC """
 # MAGIC 💡 Checkpoint: Ask students to interpret which category sells the most. How might missing categories affect this table?
+# MAGIC
+# MAGIC 💡 Teaching Note: `observed=True` tells pandas to only list category values that actually appear. Without it, grouping by two categorical columns creates every possible combination, even empty ones.
 # MAGIC """
 
 # COMMAND ----------
@@ -288,13 +367,13 @@ orders_by_hour.head()
 # COMMAND ----------
 
 # Orders by day of week
-orders_by_day = merged_df.groupby("order_day").size().reset_index(name="order_count").sort_values("order_count", ascending=False)
+orders_by_day = order_df.groupby("order_day", observed=True).size().reset_index(name="order_count").sort_values("order_count", ascending=False)
 orders_by_day
 
 # COMMAND ----------
 
 # Combine hour and day for peak-time insight
-peak_times = merged_df.groupby(["order_day", "order_hour"]).size().reset_index(name="order_count").sort_values(by="order_count", ascending=False)
+peak_times = order_df.groupby(["order_day", "order_hour"], observed=True).size().reset_index(name="order_count").sort_values(by="order_count", ascending=False)
 peak_times.head(10)
 
 # COMMAND ----------
@@ -303,24 +382,34 @@ peak_times.head(10)
 # MAGIC """
 # MAGIC # 🎭 Section 10 – Visualizations
 # MAGIC
-# MAGIC Simple plots using Pandas/Matplotlib. Keep visuals lightweight for the free tier.
+# MAGIC Simple plots using Matplotlib. Keep visuals lightweight for the free tier.
+# MAGIC
+# MAGIC 💡 Teaching Note: `fig, ax = plt.subplots()` gives us one figure we control. Calling `plt.close(fig)` after showing it frees memory, which matters when students re-run cells many times.
 # MAGIC """
 
 # COMMAND ----------
 
 # Bar chart: Orders by category
-orders_by_category.set_index("category")["order_count"].plot(kind="bar", color="skyblue", figsize=(6,4), title="Orders by Category")
-plt.ylabel("Orders")
+fig, ax = plt.subplots(figsize=(6,4))
+ax.bar(orders_by_category["category"].astype(str).to_numpy(), orders_by_category["order_count"].to_numpy(), color="skyblue")
+ax.set_title("Orders by Category")
+ax.set_ylabel("Orders")
+fig.tight_layout()
 plt.show()
+plt.close(fig)  # free the figure so re-runs do not pile up memory
 
 # COMMAND ----------
 
 # Line plot: Orders by hour
-orders_by_hour.set_index("order_hour")["order_count"].plot(kind="line", marker="o", figsize=(6,4), title="Orders by Hour")
-plt.xlabel("Hour of Day")
-plt.ylabel("Orders")
-plt.xticks(range(0,24,2))
+fig, ax = plt.subplots(figsize=(6,4))
+ax.plot(orders_by_hour["order_hour"].to_numpy(dtype=float), orders_by_hour["order_count"].to_numpy(), marker="o")
+ax.set_title("Orders by Hour")
+ax.set_xlabel("Hour of Day")
+ax.set_ylabel("Orders")
+ax.set_xticks(range(0,24,2))
+fig.tight_layout()
 plt.show()
+plt.close(fig)
 
 # COMMAND ----------
 
@@ -377,3 +466,82 @@ plt.show()
 # MAGIC
 # MAGIC 💡 Encourage students to save their cleaned datasets and document decisions for future reproducibility.
 # MAGIC """
+
+# COMMAND ----------
+
+# MAGIC %md
+# MAGIC """
+# MAGIC # 🚀 Bonus – The Same Pipeline as a Lazy Polars Query (optional)
+# MAGIC
+# MAGIC Pandas runs each step right away and builds a new DataFrame every time. **Polars** can build the whole clean → merge → groupby chain as one *lazy* plan. Nothing runs until `.collect()`, so Polars can combine steps, use all CPU cores, and read only the columns each result needs (for example, `orders_by_hour` never reads `item_name`).
+# MAGIC
+# MAGIC 💡 Teaching Note: This is an extension for curious students. If Polars is not installed on the cluster, run `%pip install polars` first; otherwise the cell below just prints a message. Pandas `groupby` drops missing (null) group keys by default, but Polars keeps them, so we drop nulls in each group key first to make the tables match the pandas results above.
+# MAGIC """
+
+# COMMAND ----------
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+    print("Polars is not installed; skipping the bonus section (run `%pip install polars` to try it).")
+
+if pl is not None:
+    menu_lazy = (
+        pl.scan_csv(menu_path)
+        .with_columns(pl.col("category").fill_null("Unknown").str.strip_chars().str.to_titlecase())
+        .filter(pl.col("price").is_not_null())
+        .unique(subset=["menu_item_id"], keep="first", maintain_order=True)
+    )
+
+    orders_lazy = (
+        pl.scan_csv(order_path)
+        .with_columns(
+            pl.col("order_date").str.to_date("%m/%d/%y", strict=False),
+            pl.col("order_time").str.to_time("%H:%M:%S", strict=False),
+        )
+        .with_columns(
+            pl.col("order_date").dt.strftime("%A").alias("order_day"),
+            pl.col("order_time").dt.hour().alias("order_hour"),
+        )
+    )
+
+    merged_lazy = orders_lazy.join(menu_lazy, left_on="item_id", right_on="menu_item_id", how="left")
+
+    # Each result is its own query; Polars only reads the columns that query needs.
+    # drop_nulls() on the group keys matches pandas, which leaves out missing keys.
+    pl_orders_by_category = (
+        merged_lazy.drop_nulls("category")
+        .group_by("category")
+        .agg(pl.len().alias("order_count"))
+        .collect(engine="streaming")
+    )
+    pl_revenue_by_item = (
+        merged_lazy.drop_nulls("item_name")
+        .group_by("item_name")
+        .agg(pl.col("price").sum().alias("revenue"))
+        .sort("revenue", descending=True)
+        .collect(engine="streaming")
+    )
+    pl_orders_by_hour = (
+        orders_lazy.drop_nulls("order_hour")
+        .group_by("order_hour")
+        .agg(pl.len().alias("order_count"))
+        .sort("order_hour")
+        .collect(engine="streaming")
+    )
+    pl_orders_by_day = (
+        orders_lazy.drop_nulls("order_day")
+        .group_by("order_day")
+        .agg(pl.len().alias("order_count"))
+        .sort("order_count", descending=True)
+        .collect(engine="streaming")
+    )
+    pl_peak_times = (
+        orders_lazy.drop_nulls(["order_day", "order_hour"])
+        .group_by(["order_day", "order_hour"])
+        .agg(pl.len().alias("order_count"))
+        .sort("order_count", descending=True)
+        .collect(engine="streaming")
+    )
+    print(pl_peak_times.head(10))
@@ -41,119 +41,181 @@
 # MAGIC ## Setup – Using an Existing Curated DataFrame
 # MAGIC In Assignment 3.2, students created a curated DataFrame called `final_df` by joining and cleaning STEDI data. For the live demo, we simulate a small `final_df` with a few rows.
 # MAGIC 
-# MAGIC **Reminder:** In the real student notebook, `final_df` comes from their ETL steps (joins, cleaning, labeling). Here we create a tiny example so the notebook is self-contained.
+# MAGIC **Reminder:** In the real student notebook, the curated rows come from their ETL steps (joins, cleaning, labeling). Here we create a tiny, already-labeled `final_df` so the notebook is self-contained. The "Clean ETL" template near the end goes one step further: it exposes the joined data as a temp view `df_joined_view` and adds the labels inside the final SQL write, so there is no separate `final_df` there.
 # COMMAND ----------
-# Import PySpark functions
+# Import PySpark functions and pandas
 from pyspark.sql import functions as F
+import pandas as pd
+
+# Send pandas data to Spark as columnar Arrow batches instead of row by row
+spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+
+# Adaptive Query Execution (AQE): Spark adjusts the plan at runtime using real data sizes.
+# It merges tiny shuffle partitions (instead of the fixed default of 200) and splits skewed ones.
+spark.conf.set("spark.sql.adaptive.enabled", "true")
+spark.conf.set("spark.sql.adaptive.coalescePartitions.enabled", "true")
+spark.conf.set("spark.sql.adaptive.skewJoin.enabled", "true")
+spark.conf.set("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64MB")
 
 # Simulated curated DataFrame from Assignment 3.2
 sample_data = [
-    ("CUST-001", "DEV-101", "step", "device"),
-    ("CUST-002", "DEV-102", "no_step", "step"),
-    ("CUST-003", "DEV-103", "step", "device"),
-    ("CUST-004", "DEV-104", "no_step", "step"),
+    ("CUST-001", "DEV-101", "step", "device", "2024-01-15"),
+    ("CUST-002", "DEV-102", "no_step", "step", "2024-01-15"),
+    ("CUST-003", "DEV-103", "step", "device", "2024-01-16"),
+    ("CUST-004", "DEV-104", "no_step", "step", "2024-01-16"),
 ]
 
-final_df = spark.createDataFrame(
+sample_pdf = pd.DataFrame(
     sample_data,
-    ["customer", "device_id", "step_label", "source_label"]
-)
+    columns=["customer", "device_id", "step_label", "source_label", "reading_date"]
+).astype("string")
+
+final_df = spark.createDataFrame(sample_pdf)
+
+# reading_date is the day the sensor reading was taken (from the data, not the job run date).
+# The curated table is partitioned by it, so a rerun replaces the same days instead of adding copies.
+final_df = final_df.withColumn("reading_date", F.to_date("reading_date"))
+final_df.createOrReplaceTempView("final_df")
 
 # Show the simulated data
 final_df.show()
 # COMMAND ----------
 # MAGIC %md
 # MAGIC ## Writing the Curated Table (SQL) – Key Pattern
-# MAGIC The **final cell** of the automated ETL notebook should overwrite the curated table. Use `CREATE OR REPLACE` so each run refreshes the table.
+# MAGIC The **final cell** of the automated ETL notebook should refresh the curated table. The table is **partitioned by `reading_date`** (the day each sensor reading was taken). `INSERT OVERWRITE` replaces only the days present in `final_df`. Re-running the job recomputes the same days and replaces those partitions, so rows are never duplicated.
 # MAGIC 
 # MAGIC ```sql
-# MAGIC CREATE OR REPLACE TABLE labeled_step_test AS
+# MAGIC CREATE TABLE IF NOT EXISTS labeled_step_test (...)
+# MAGIC USING DELTA
+# MAGIC PARTITIONED BY (reading_date);
+# MAGIC 
+# MAGIC INSERT OVERWRITE TABLE labeled_step_test PARTITION (reading_date)
 # MAGIC SELECT * FROM final_df;
 # MAGIC ```
 # MAGIC 
 # MAGIC **Instructor Tip:** Common mistakes:
 # MAGIC - Typo in the table name (`labeled_step_test`).
-# MAGIC - Using a different DataFrame name instead of `final_df`.
+# MAGIC - Reading from the wrong temp view name (`final_df` in this demo, `df_joined_view` in the clean ETL template), or forgetting `createOrReplaceTempView` so SQL cannot see the DataFrame.
 # MAGIC - Forgetting to run this cell before validating.
+# MAGIC - Forgetting `partitionOverwriteMode = dynamic`: without it, `INSERT OVERWRITE` replaces **every** partition, not just the days in `final_df`.
+# MAGIC - Partitioning by the job's run date (`current_date()`): every run would add another full copy of the same readings.
+# MAGIC - An older, unpartitioned `labeled_step_test` already exists. Drop it once (`DROP TABLE labeled_step_test`) so it can be re-created with partitions.
 # COMMAND ----------
 %sql
--- Overwrite curated table from the final DataFrame
-CREATE OR REPLACE TABLE labeled_step_test AS
+-- Create the curated table once, partitioned by the reading date
+CREATE TABLE IF NOT EXISTS labeled_step_test (
+  customer STRING,
+  device_id STRING,
+  step_label STRING,
+  source_label STRING,
+  reading_date DATE
+)
+USING DELTA
+PARTITIONED BY (reading_date);
+
+-- Rewrite only the reading_date partitions present in final_df
+SET spark.sql.sources.partitionOverwriteMode = dynamic;
+INSERT OVERWRITE TABLE labeled_step_test PARTITION (reading_date)
 SELECT * FROM final_df;
 # COMMAND ----------
 # MAGIC %md
-# MAGIC ## Validating the Pipeline with SQL Queries
-# MAGIC After the job runs, use SQL checks to confirm labels and counts. Run these in order and interpret the results out loud.
+# MAGIC **Guard the labels at write time:** A Delta `CHECK` constraint makes any write with a bad label **fail** instead of silently landing in the table. Run this cell once after the table is created; the constraints stay on the table for every future job run.
 # COMMAND ----------
 %sql
--- 1) Steps vs. No-Steps count
-SELECT step_label, COUNT(*)
-FROM labeled_step_test
-GROUP BY step_label;
+-- One-time setup: only allow valid labels (re-runnable because we drop first)
+ALTER TABLE labeled_step_test DROP CONSTRAINT IF EXISTS valid_step_label;
+ALTER TABLE labeled_step_test ADD CONSTRAINT valid_step_label
+  CHECK (step_label IS NOT NULL AND step_label IN ('step', 'no_step'));
+
+ALTER TABLE labeled_step_test DROP CONSTRAINT IF EXISTS valid_source_label;
+ALTER TABLE labeled_step_test ADD CONSTRAINT valid_source_label
+  CHECK (source_label IS NOT NULL AND source_label IN ('device', 'step'));
 # COMMAND ----------
 # MAGIC %md
-# MAGIC **Good result:** Only `step` and `no_step` rows with realistic counts.
+# MAGIC ## Validating the Pipeline with SQL Queries
+# MAGIC After the job runs, use SQL checks to confirm labels and counts. Run these in order and interpret the results out loud.
+# MAGIC 
+# MAGIC We first **cache** the table, then compute all label counts in **one** query (one table scan instead of one scan per check). Query 1 already answers every check: `bad_step` and `bad_src` are the invalid-row counts.
 # MAGIC 
-# MAGIC **Bad result:** Missing labels, spelling issues, or extra categories indicate problems in the labeling logic.
+# MAGIC Queries 2 and 3 are **optional** and repeat those two numbers. We keep them only for the `CHECK` constraint demo: each one is a plain `WHERE` filter that students can change to `SELECT *` to see the bad rows. They read from the cache, so skip them when time is short.
 # COMMAND ----------
 %sql
--- 2) Invalid or missing step labels
-SELECT *
-FROM labeled_step_test
-WHERE step_label NOT IN ('step', 'no_step')
-   OR step_label IS NULL
-LIMIT 50;
+-- Keep the table in memory so the validation queries below scan the files only once.
+-- LAZY: the cache is filled by the first query that reads the table, not right now.
+CACHE LAZY TABLE labeled_step_test;
+# COMMAND ----------
+%sql
+-- 1) All label counts in a single pass
+SELECT
+  SUM(CASE WHEN step_label = 'step' THEN 1 ELSE 0 END) AS step_cnt,
+  SUM(CASE WHEN step_label = 'no_step' THEN 1 ELSE 0 END) AS nostep_cnt,
+  SUM(CASE WHEN step_label IS NULL OR step_label NOT IN ('step', 'no_step') THEN 1 ELSE 0 END) AS bad_step,
+  SUM(CASE WHEN source_label = 'device' THEN 1 ELSE 0 END) AS dev_cnt,
+  SUM(CASE WHEN source_label = 'step' THEN 1 ELSE 0 END) AS src_step,
+  SUM(CASE WHEN source_label IS NULL OR source_label NOT IN ('device', 'step') THEN 1 ELSE 0 END) AS bad_src
+FROM labeled_step_test;
 # COMMAND ----------
 # MAGIC %md
-# MAGIC **Good result:** Zero rows returned.
+# MAGIC **Good result:** Realistic counts in `step_cnt`, `nostep_cnt`, `dev_cnt`, and `src_step`, and **zero** in `bad_step` and `bad_src`.
 # MAGIC 
-# MAGIC **Bad result:** Any rows here suggest a join problem, typo, or missing labeling rule.
+# MAGIC **Bad result:** Any non-zero `bad_step` or `bad_src` means missing labels, spelling issues, or extra categories. With the `CHECK` constraints in place this should not happen, because bad rows are rejected at write time.
 # MAGIC 
-# MAGIC **Discussion Question:** If you see NULL `step_label`, which step in your ETL might be broken?
+# MAGIC **Discussion Question:** If you see unexpected labels, what might have happened to your source data or mapping?
 # COMMAND ----------
 %sql
--- 3) Source label counts
-SELECT source_label, COUNT(*)
+-- 2) Optional: same number as bad_step in query 1 (count only; change COUNT(*) to * to see rows)
+SELECT COUNT(*) AS invalid_step_rows
 FROM labeled_step_test
-GROUP BY source_label;
+WHERE step_label NOT IN ('step', 'no_step')
+   OR step_label IS NULL;
 # COMMAND ----------
 # MAGIC %md
-# MAGIC **Good result:** Only `device` and `step` categories appear.
+# MAGIC **Good result:** `invalid_step_rows` is 0 (it must equal `bad_step` from query 1).
 # MAGIC 
-# MAGIC **Bad result:** Extra labels or NULLs may indicate incorrect joins or case-sensitive spelling errors.
+# MAGIC **Bad result:** Any count above 0 suggests a join problem, typo, or missing labeling rule (and that the constraint was dropped). Change `COUNT(*)` to `*` with `LIMIT 50` to look at the rows.
 # MAGIC 
-# MAGIC **Discussion Question:** If you see unexpected labels, what might have happened to your source data or mapping?
+# MAGIC **Discussion Question:** If you see NULL `step_label`, which step in your ETL might be broken?
 # COMMAND ----------
 %sql
--- 4) Invalid source labels
-SELECT *
+-- 3) Optional: same number as bad_src in query 1
+SELECT COUNT(*) AS invalid_source_rows
 FROM labeled_step_test
 WHERE source_label NOT IN ('device', 'step')
-   OR source_label IS NULL
-LIMIT 50;
+   OR source_label IS NULL;
 # COMMAND ----------
 # MAGIC %md
-# MAGIC **Good result:** Zero rows.
+# MAGIC **Good result:** `invalid_source_rows` is 0 (it must equal `bad_src` from query 1).
 # MAGIC 
 # MAGIC **Bad result:** Investigate missing joins, wrong column names, or unhandled label values.
 # MAGIC 
 # MAGIC **Discussion Question:** How would you track down where an invalid label was created?
+# MAGIC 
+# MAGIC **Instructor Tip:** In the Spark UI, the first validation query shows a `FileScan`; the later ones should show `InMemoryTableScan`. That is the cache at work.
+# COMMAND ----------
+%sql
+-- Free the cached memory now that validation is done
+UNCACHE TABLE labeled_step_test;
 # COMMAND ----------
 # MAGIC %md
 # MAGIC ## Common Troubleshooting Patterns
 # MAGIC Use this quick checklist when validations fail:
-# MAGIC - ✅ Did the notebook actually rewrite the table? Re-run the `CREATE OR REPLACE` cell.
+# MAGIC - ✅ Did the notebook actually rewrite the table? Re-run the `INSERT OVERWRITE` cell.
 # MAGIC - ✅ Did the join create duplicates or missing rows? Compare counts before and after joins.
 # MAGIC - ✅ Are labels spelled correctly (case-sensitive)? Use `DISTINCT` to see unique values.
 # MAGIC - ✅ Are there NULL labels? Look for missing join keys or filters.
 # MAGIC 
 # MAGIC **Mini examples**
-# MAGIC - Check row counts before and after a join (example placeholder):
+# MAGIC - Check row counts before and after a join (example placeholder). Remember: every `.count()` is an **action** that scans all the data again, so avoid calling it many times on big tables.
 # MAGIC 
 # MAGIC ```python
-# MAGIC before_count = df_steps.count()
-# MAGIC after_count = df_steps.join(df_labels, "device_id", "left").count()
-# MAGIC print(before_count, after_count)
+# MAGIC # Quick estimate (stops after about 1 second, 95% confidence)
+# MAGIC approx_before = df_steps.rdd.countApprox(1000, 0.95)
+# MAGIC 
+# MAGIC # Exact counts in one pass: rows with a matching label vs rows without one
+# MAGIC (df_steps.join(df_labels.withColumn("has_label", F.lit(True)), "device_id", "left")
+# MAGIC     .groupBy(F.col("has_label").isNotNull().alias("matched"))
+# MAGIC     .count()
+# MAGIC     .show())
 # MAGIC ```
 # MAGIC 
 # MAGIC - View all distinct step labels:
@@ -161,6 +223,8 @@ LIMIT 50;
 # MAGIC SELECT DISTINCT step_label FROM labeled_step_test;
 # MAGIC ```
 # MAGIC 
+# MAGIC **Instructor Tip:** `DISTINCT` is a grouping, so it shuffles. Because AQE is on, open the Spark UI for this query: the shuffle should use only 1–2 partitions for this tiny table, not the default 200.
+# MAGIC 
 # MAGIC - Quick NULL check:
 # MAGIC ```sql
 # MAGIC SELECT COUNT(*) AS null_steps
@@ -175,41 +239,72 @@ LIMIT 50;
 # 1. Imports and configuration
 from pyspark.sql import functions as F
 
+# Adaptive Query Execution: merge small shuffle partitions (fewer files) and split skewed joins
+spark.conf.set("spark.sql.adaptive.enabled", "true")
+spark.conf.set("spark.sql.adaptive.coalescePartitions.enabled", "true")
+spark.conf.set("spark.sql.adaptive.skewJoin.enabled", "true")
+spark.conf.set("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64MB")
+
+# Let Spark broadcast tables up to 50MB (small lookup tables like demographics fit easily)
+spark.conf.set("spark.sql.autoBroadcastJoinThreshold", "50MB")
+
 # 2. Load raw data tables (replace with real catalog.schema paths)
 df_device = spark.table("<your_catalog>.<your_schema>.raw_device_message")
 df_step = spark.table("<your_catalog>.<your_schema>.raw_step_trainer")
 df_demo = spark.table("<your_catalog>.<your_schema>.raw_demographics")
 
-# 3. Transform and join (simplified placeholders)
-df_joined = (
-    df_device.join(df_step, on="sensor_reading_time", how="inner")
-             .join(df_demo, on="serial_number", how="inner")
-)
-
-# 4. Add labels (placeholder logic)
-df_labeled = df_joined.withColumn(
-    "step_label",
-    F.when(F.col("heart_rate") > 100, F.lit("step")).otherwise(F.lit("no_step"))
-).withColumn(
-    "source_label",
-    F.when(F.col("heart_rate") > 100, F.lit("step")).otherwise(F.lit("device"))
-)
+# Optional (off by default): cache the raw reads if you add profiling/QA actions (count, show, display),
+# so those actions do not re-scan the files. In this write-once job the final write is the only action,
+# so cache() would just hold every table (including the big device table) in memory for a single use.
+# Uncomment together with the unpersist() cell after the write.
+# for df in (df_device, df_step, df_demo):
+#     df.cache()
 
-# 5. Final curated DataFrame
-final_df = df_labeled.select(
-    "customer",
-    "device_id",
-    "step_label",
-    "source_label"
-)
+# 3. Transform and join (simplified placeholders)
+# Rule: put the most selective / smallest join first, because Catalyst keeps the written join order.
+# Join the two small tables (step + demographics) first, then join that small result to the device data.
+# F.broadcast() copies the small side to every worker, so the big table is not shuffled.
+# Tip: if the tables have statistics (ANALYZE TABLE ... COMPUTE STATISTICS FOR ALL COLUMNS),
+# the cost-based optimizer can help choose join strategies.
+df_step_demo = df_step.join(F.broadcast(df_demo), on="serial_number", how="inner")
+df_joined = df_device.join(F.broadcast(df_step_demo), on="sensor_reading_time", how="inner")
+# Check the plan: both joins should show BroadcastHashJoin and no "Exchange hashpartitioning"
+# df_joined.explain()
 
-# 6. Final SQL to write the curated table
-final_df.createOrReplaceTempView("final_df")
+# 4. Expose the joined data to SQL; labels are added in the final write (next cell),
+# so join -> labels -> write runs as one query with no extra DataFrame step in between
+df_joined.createOrReplaceTempView("df_joined_view")
 # COMMAND ----------
 %sql
 -- Final write step in the clean ETL notebook
-CREATE OR REPLACE TABLE labeled_step_test AS
-SELECT * FROM final_df;
+CREATE TABLE IF NOT EXISTS labeled_step_test (
+  customer STRING,
+  device_id STRING,
+  step_label STRING,
+  source_label STRING,
+  reading_date DATE
+)
+USING DELTA
+PARTITIONED BY (reading_date);
+
+-- 5. Add labels (placeholder logic) and write the curated table in one statement.
+-- The CHECK constraints added once in the demo stay on the table and reject bad labels here.
+SET spark.sql.sources.partitionOverwriteMode = dynamic;
+INSERT OVERWRITE TABLE labeled_step_test PARTITION (reading_date)
+SELECT
+  customer,
+  device_id,
+  CASE WHEN heart_rate > 100 THEN 'step' ELSE 'no_step' END AS step_label,
+  CASE WHEN heart_rate > 100 THEN 'step' ELSE 'device' END AS source_label,
+  -- Day of the reading (from the data), so a rerun replaces the same partitions.
+  -- If sensor_reading_time is epoch milliseconds, use to_date(timestamp_millis(sensor_reading_time)).
+  to_date(sensor_reading_time) AS reading_date
+FROM df_joined_view;
+# COMMAND ----------
+# Optional: only needed if you uncommented the cache() loop above.
+# Releases just the three cached raw tables now that the write is done.
+# for df in (df_device, df_step, df_demo):
+#     df.unpersist()
 # COMMAND ----------
 # MAGIC %md
 # MAGIC ## Talking Through the Databricks Job UI (Demo Script)
@@ -236,7 +331,7 @@ SELECT * FROM final_df;
 # MAGIC %md
 # MAGIC ## Wrap-Up & Practice Ideas
 # MAGIC **Key Takeaways**
-# MAGIC - Clean ETL notebooks are short, repeatable, and end with `CREATE OR REPLACE TABLE labeled_step_test`.
+# MAGIC - Clean ETL notebooks are short, repeatable, and end with `INSERT OVERWRITE TABLE labeled_step_test PARTITION (reading_date)`.
 # MAGIC - Databricks Jobs rerun the notebook automatically, so validations must be quick and reliable.
 # MAGIC - SQL validation queries catch label errors early.
 # MAGIC 
@@ -9,13 +9,13 @@
 # MAGIC **Learning goals for students (you will demo):**
 # MAGIC - See how to reload a previously tuned model and transformed features.
 # MAGIC - Practice a *refinement* hyperparameter search (smaller, smarter grid).
-# MAGIC - Compare old vs new models and decide whether to keep or replace the best model.
+# MAGIC - Compare old vs new models and decide whether the tuned model is worth saving as a candidate next to the current best model.
 # MAGIC - Model responsible AI thinking (fairness, stability, and documentation) during tuning.
 # MAGIC 
 # MAGIC **What this live demo shows:**
 # MAGIC - Loading saved artifacts from `/dbfs/FileStore` or creating synthetic data if missing.
 # MAGIC - Designing a narrower grid based on prior results (and SHAP insights).
-# MAGIC - Running `GridSearchCV`, comparing metrics, and saving an updated best model when appropriate.
+# MAGIC - Running `HalvingGridSearchCV` / `GridSearchCV`, comparing metrics, and saving the tuned model as a separate **candidate** file when appropriate (the current best model file is not changed).
 # MAGIC - Instructor talking points for ethics and gospel-oriented reflection.
 
 # COMMAND ----------
@@ -31,10 +31,10 @@ import numpy as np
 import pandas as pd
 
 from sklearn.datasets import make_classification
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import HistGradientBoostingClassifier, RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import GridSearchCV, train_test_split
-from sklearn.metrics import accuracy_score
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401 (enables HalvingGridSearchCV)
+from sklearn.model_selection import GridSearchCV, HalvingGridSearchCV, train_test_split
 
 # Helper: load transformed data if present, otherwise create synthetic
 
@@ -47,8 +47,10 @@ def load_or_create_demo_data(random_state: int = 42):
     y_test_path = os.path.join(base_path, "y_test.pkl")
 
     try:
-        X_train = np.load(X_train_path)
-        X_test = np.load(X_test_path)
+        # Memory-map the arrays: pages are read from disk only when used, and worker
+        # processes can share them. The float32 step below copies only if the saved dtype differs.
+        X_train = np.load(X_train_path, mmap_mode="r")
+        X_test = np.load(X_test_path, mmap_mode="r")
         y_train = joblib.load(y_train_path)
         y_test = joblib.load(y_test_path)
         print("Loaded transformed STEDI datasets from /dbfs/FileStore.")
@@ -66,17 +68,28 @@ def load_or_create_demo_data(random_state: int = 42):
         X_train, X_test, y_train, y_test = train_test_split(
             X, y, test_size=0.2, random_state=random_state, stratify=y
         )
+
+    # Compact, contiguous arrays: float32 halves memory traffic for the many passes sklearn makes
+    X_train = np.ascontiguousarray(X_train, dtype=np.float32)
+    X_test = np.ascontiguousarray(X_test, dtype=np.float32)
+    y_train = np.asarray(y_train)
+    y_test = np.asarray(y_test)
+    if y_train.dtype.kind in "biu":  # integer/bool class labels fit in int8; keep text labels as-is
+        y_train = y_train.astype(np.int8)
+        y_test = y_test.astype(np.int8)
     return X_train, X_test, y_train, y_test
 
 
-def safe_load_model(path: str, default_model):
-    """Try to load a model; fall back to default_model if missing."""
+def safe_load_model(path: str, default_model, X=None, y=None):
+    """Try to load a model; fall back to default_model (fitted on X, y when given) if missing."""
     try:
         model = joblib.load(path)
         print(f"Loaded model from {path}")
         return model
     except Exception as exc:  # noqa: BLE001 (explicitly catching load errors for demo)
         print(f"Could not load {path}: {exc}\nUsing provided default model instead.")
+        if X is not None and y is not None:
+            default_model.fit(X, y)  # only train the fallback when it is actually used
         return default_model
 
 # COMMAND ----------
@@ -94,18 +107,23 @@ def safe_load_model(path: str, default_model):
 # COMMAND ----------
 # Load data (real or synthetic)
 X_train, X_test, y_train, y_test = load_or_create_demo_data()
+print(f"X_train: dtype={X_train.dtype}, C-contiguous={X_train.flags['C_CONTIGUOUS']}")
 
 # Try to load the prior best model; fall back to a quick-fit RandomForest
 best_model_path = "/dbfs/FileStore/stedi_best_model.pkl"
-old_model = safe_load_model(best_model_path, RandomForestClassifier(random_state=42))
+# (the fallback is fitted on the training data inside safe_load_model so metrics make sense)
+old_model = safe_load_model(
+    best_model_path, RandomForestClassifier(random_state=42, n_jobs=-1), X_train, y_train
+)
 
-# If we loaded a fresh default model, fit it quickly so metrics make sense
-if not hasattr(old_model, "feature_importances_") and isinstance(old_model, RandomForestClassifier):
-    old_model.fit(X_train, y_train)
+# Baseline performance: predict train + test in one call (one pass through the trees), then split
+X_all = np.vstack([X_train, X_test])
+preds = old_model.predict(X_all)
+old_train_pred, old_test_pred = preds[:len(y_train)], preds[len(y_train):]
 
-# Baseline performance
-train_acc = accuracy_score(y_train, old_model.predict(X_train))
-test_acc = accuracy_score(y_test, old_model.predict(X_test))
+# Accuracy = share of predictions that match the labels (a vectorized compare + mean)
+train_acc = float(np.mean(old_train_pred == y_train))
+test_acc = float(np.mean(old_test_pred == y_test))
 
 print(f"Loaded model type: {type(old_model)}")
 print(f"Train accuracy: {train_acc:.3f}")
@@ -135,22 +153,22 @@ print(f"Test accuracy: {test_acc:.3f}")
 # MAGIC - Runtime limits of the current cluster.
 # MAGIC 
 # MAGIC **Example grids:**
-# MAGIC - **RandomForestClassifier:** explore tree depth and leaf sizes to control complexity.
+# MAGIC - **HistGradientBoostingClassifier:** explore tree depth, learning rate, and number of boosting rounds. It is a fast tree ensemble that groups feature values into bins and uses all CPU cores on its own.
 # MAGIC - **LogisticRegression:** explore regularization strength to balance bias/variance.
 # MAGIC 
 # MAGIC **Key hyperparameters (plain language):**
-# MAGIC - `n_estimators`: number of trees (more trees can capture more patterns but cost time).
-# MAGIC - `max_depth`: how deep each tree can grow (None lets trees grow fully; risk of overfitting).
-# MAGIC - `min_samples_leaf`: minimum samples in a leaf (higher values simplify the tree).
+# MAGIC - `max_iter`: number of boosting rounds (trees added one after another; more rounds cost time).
+# MAGIC - `max_depth`: how deep each tree can grow (None means no depth limit; risk of overfitting).
+# MAGIC - `learning_rate`: how much each new tree corrects the previous ones (smaller = slower, steadier learning).
 # MAGIC - `C` (LogReg): strength of regularization (higher C = less regularization).
 # MAGIC - `penalty`, `solver`: how the optimizer handles regularization.
 
 # COMMAND ----------
 # Example parameter grids
-rf_param_grid = {
-    "n_estimators": [100, 200],
-    "max_depth": [None, 10, 20],
-    "min_samples_leaf": [1, 2, 4],
+hgb_param_grid = {
+    "max_depth": [None, 6, 10],
+    "learning_rate": [0.05, 0.1],
+    "max_iter": [100, 200],
 }
 
 log_reg_param_grid = {
@@ -159,34 +177,46 @@ log_reg_param_grid = {
     "solver": ["lbfgs"],
 }
 
-# Instructor tip: Use Random Forest when you expect non-linear relationships; use Logistic Regression when you prefer simpler, more explainable boundaries.
+# Instructor tip: Use tree ensembles (like gradient boosting) when you expect non-linear relationships; use Logistic Regression when you prefer simpler, more explainable boundaries.
 # Instructor tip: If the cluster is slow, shrink these lists to 1–2 values each.
 
 # COMMAND ----------
 # MAGIC %md
-# MAGIC ## Section 4 – Running GridSearchCV (Live Demo)
+# MAGIC ## Section 4 – Running HalvingGridSearchCV (Live Demo)
 # MAGIC 
 # MAGIC `GridSearchCV` tries each parameter combination with cross-validation and returns the best settings.
 # MAGIC 
+# MAGIC `HalvingGridSearchCV` is a faster cousin (successive halving): it first tries **every** combination on a small part of the training data, keeps the best third, gives them more data, and repeats. Only the strongest candidates are trained on all the data. The result API (`best_params_`, `best_score_`, `best_estimator_`) is the same.
+# MAGIC 
 # MAGIC **Pause points for class:**
 # MAGIC - What happens if the grid is too big? (Long runtime, risk of overfitting to CV.)
 # MAGIC - What if the scoring metric does not match the business goal? (We might pick the wrong model.)
 
 # COMMAND ----------
-# Run a refinement grid search for RandomForestClassifier
-rf_model = RandomForestClassifier(random_state=42)
-rf_grid_search = GridSearchCV(
-    estimator=rf_model,
-    param_grid=rf_param_grid,
+# Run a refinement grid search for HistGradientBoostingClassifier
+# The model already uses all CPU cores (OpenMP threads), so GridSearchCV runs one fit at a time
+# (n_jobs=1) instead of copying X_train into many worker processes.
+# Instructor tip: on the cluster, set OMP_NUM_THREADS to the number of physical cores.
+# Instructor tip: if students add a preprocessing step (e.g., StandardScaler), wrap it and the model in
+# Pipeline([("scale", StandardScaler()), ("clf", ...)], memory="/dbfs/tmp/sk_cache") and prefix the
+# grid keys with "clf__". memory= caches the fitted scaler, so it is fitted once per CV fold instead of
+# once per (fold, parameter) pair. With no preprocessing step there is nothing to cache.
+hgb_model = HistGradientBoostingClassifier(random_state=42)
+hgb_grid_search = HalvingGridSearchCV(
+    estimator=hgb_model,
+    param_grid=hgb_param_grid,
     cv=3,
     scoring="accuracy",
-    n_jobs=-1,
+    n_jobs=1,
+    factor=3,  # keep the best 1/3 of candidates each round
+    resource="n_samples",
+    min_resources="exhaust",  # size the first round so the last round uses all training rows
 )
 
-rf_grid_search.fit(X_train, y_train)
+hgb_grid_search.fit(X_train, y_train)
 
-print("Best params:", rf_grid_search.best_params_)
-print(f"Best CV accuracy: {rf_grid_search.best_score_:.3f}")
+print("Best params:", hgb_grid_search.best_params_)
+print(f"Best CV accuracy: {hgb_grid_search.best_score_:.3f}")
 
 # COMMAND ----------
 # MAGIC %md
@@ -213,8 +243,8 @@ print(f"LogReg best CV accuracy: {log_reg_grid_search.best_score_:.3f}")
 # MAGIC We compare test accuracy for the prior best model vs the tuned model. Remind students that stability, fairness, and simplicity also matter—sometimes we keep the old model if improvements are tiny or noisy.
 
 # COMMAND ----------
-old_test_acc = accuracy_score(y_test, old_model.predict(X_test))
-new_test_acc = accuracy_score(y_test, rf_grid_search.best_estimator_.predict(X_test))
+old_test_acc = test_acc  # reuse the Section 1 result
+new_test_acc = float(np.mean(hgb_grid_search.best_estimator_.predict(X_test) == y_test))
 
 comparison_df = pd.DataFrame(
     {
@@ -228,18 +258,36 @@ print(comparison_df)
 
 # COMMAND ----------
 # MAGIC %md
-# MAGIC ## Section 6 – Saving the Updated Best Model Responsibly
+# MAGIC ## Section 6 – Saving the Tuned Model as a Candidate
 # MAGIC 
-# MAGIC Overwrite `stedi_best_model.pkl` **only** if the new model is clearly as good or better and still reasonable. Modeling good practice includes logging decisions (even briefly) and noting open questions.
+# MAGIC Save the tuned model **only** if it is clearly as good or better and still reasonable. It is saved as a **candidate**, not as the new best model. Modeling good practice includes logging decisions (even briefly) and noting open questions.
+# MAGIC 
+# MAGIC The tuned model is a `HistGradientBoostingClassifier`, so we save it to its **own file**, `stedi_best_model_hgb.pkl`. We do not overwrite `stedi_best_model.pkl`, because Lab 5.3 loads that file as a Random Forest and uses its `feature_importances_`, which gradient boosting does not provide.
+# MAGIC 
+# MAGIC Because Section 1 always reloads `stedi_best_model.pkl`, a second refinement round still compares against the original Random Forest. Promoting the candidate to "best model" is a separate, documented decision: an instructor reviews it and only then replaces `stedi_best_model.pkl` (and updates Lab 5.3 to match).
 
 # COMMAND ----------
+# Separate file: stedi_best_model.pkl stays the Random Forest that Lab 5.3 reads
+tuned_model_path = "/dbfs/FileStore/stedi_best_model_hgb.pkl"
+
 if new_test_acc >= old_test_acc:
-    print("New model is as good or better — saving as new best model.")
-    joblib.dump(rf_grid_search.best_estimator_, "/dbfs/FileStore/stedi_best_model.pkl")
+    print(f"New model is as good or better — saving it as a candidate to {tuned_model_path}.")
+    # Compressed, protocol-5 pickle: smaller file and faster DBFS write (joblib.load detects compression)
+    try:
+        import lz4  # noqa: F401 (fast compressor; fall back to zlib if not installed)
+        compress = ("lz4", 3)
+    except ImportError:
+        compress = ("zlib", 3)
+    joblib.dump(
+        hgb_grid_search.best_estimator_,
+        tuned_model_path,
+        compress=compress,
+        protocol=5,
+    )
 else:
-    print("Old model performed better. Keeping the old model.")
+    print("Old model performed better. No candidate saved.")
 
-# Instructor tip: Invite students to explain why they would or would not overwrite the file.
+# Instructor tip: Invite students to explain why they would or would not save the new model.
 
 # COMMAND ----------
 # MAGIC %md